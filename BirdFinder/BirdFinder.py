@@ -8,6 +8,9 @@ from operator import itemgetter
 import ebird
 import init
 import data
+import planner
+import anytime
+import snapshot
 
 class ListType(Enum):
     LIFE = 1  #want to find birds never seen, no matter the place
@@ -191,18 +194,7 @@ def getPlacesDict(needs:dict, lat:float, lng:float, daysback:int, distKM:int) ->
         locationlist = ebird.getLocationsForBird(lat, lng, daysback, distKM, b["speciesCode"])
 
         if len(locationlist) > 0:
-            for p in locationlist:
-                #p is a place with a locID. if the place is in our dict then add the bird name. 
-                #If the place is NOT in our dict then add the place and the bird name
-            
-                if p["locName"] in placesdict:
-                    log.debug("Adding {} to public place {}".format(b["comName"], p["locName"]))
-                    placesdict[p["locName"]]["seen"].add(b["comName"])
-
-                else:
-                    #place is not in our list, 
-                    log.debug("Adding a new place {} for bird {}".format(p["locName"], b["comName"]))
-                    placesdict[p["locName"]] = {"lat" : p["lat"], "lng" : p["lng"], "private" : p["locationPrivate"], "seen" :{b["comName"]} }
+            anytime.addLocationsForBird(placesdict, b["comName"], locationlist)
         else:
             log.critical("Ebird says you need {} but then failed to return any locations".format(b["comName"]))
     
@@ -256,7 +248,7 @@ def prioritizePlaces(placesdict:dict) -> list:
     return cleanresult
 
 #Print out all results
-def printResults(todomsg:str, placesdict:dict, showprivate:bool, regiondata:dict, state:str) -> bool:
+def printResults(todomsg:str, placesdict:dict, itinerary:list, showprivate:bool, regiondata:dict, state:str, unresolved:list, failed:list) -> bool:
     log.info("Get list of all places where birds we need have been seen")
 
     print("Saving results to file...")
@@ -277,6 +269,23 @@ def printResults(todomsg:str, placesdict:dict, showprivate:bool, regiondata:dict
         f = open("results.txt", "w")
         f.write(todomsg)
 
+        #if we ran out of time, say which birds aren't in the results so nobody thinks they weren't around
+        if len(unresolved) > 0:
+            f.write("\nRan out of time before checking where these birds were seen:\n")
+            for b in unresolved:
+                f.write("\t{}\n".format(b["comName"]))
+
+        if len(failed) > 0:
+            f.write("\neBird returned an error when checking where these birds were seen:\n")
+            for b in failed:
+                f.write("\t{}\n".format(b["comName"]))
+
+        if len(itinerary) > 0:
+            f.write("\n\nSuggested itinerary\n")
+            f.write("-------------------\n")
+            for i, p in enumerate(itinerary, start = 1):
+                f.write("{}) {} ({}, {})\n".format(i, p, placesdict[p]["lat"], placesdict[p]["lng"]))
+
         if len(publicplaceresults) > 0:
             f.write("\n\nPublic places you can go\n")
             f.write("------------------------\n")
@@ -328,17 +337,29 @@ def printResults(todomsg:str, placesdict:dict, showprivate:bool, regiondata:dict
 # turn on logging
 log = init.get_module_logger(__name__)
 
-#Load the ebird taxonomy
-ebirdtaxonomy = ebird.getEbirdTaxonomyDict(init.ebirdtaxonomyfilename)
+#If nothing has changed since last time, the taxonomy, life list and region data can come straight
+#from the snapshot instead of being built again
+snapshotsources = [init.ebirdtaxonomyfilename, init.lifelistfilename] + [data.getRegionFileName(r) for r in init.regions]
+warmstate = snapshot.attachSnapshot(init.snapshotfilename, snapshotsources)
 
-#Load life list
-lifedict = getNALifeDict(init.lifelistfilename, ebirdtaxonomy)
-if len(lifedict) == 0:
-    log.critical("Major error happened getting life list")
-    sys.exit(0)
+if warmstate != None:
+    ebirdtaxonomy, lifedict, regiondata = warmstate
+
+else:
+    #Load the ebird taxonomy
+    ebirdtaxonomy = ebird.getEbirdTaxonomyDict(init.ebirdtaxonomyfilename)
+
+    #Load life list
+    lifedict = getNALifeDict(init.lifelistfilename, ebirdtaxonomy)
+    if len(lifedict) == 0:
+        log.critical("Major error happened getting life list")
+        sys.exit(0)
 
-#Load and process region data to generate prioritization criteria
-regiondata = data.loadAllRegionData(ebirdtaxonomy)
+    #Load and process region data to generate prioritization criteria
+    regiondata = data.loadAllRegionData(ebirdtaxonomy)
+
+    #if it can't be saved, no problem, we'll build everything again next time
+    snapshot.writeSnapshot(init.snapshotfilename, ebirdtaxonomy, lifedict, regiondata, snapshotsources)
 
 #TODO Add GPS coordinates of the location to the name in the results file
 #TODO Ask user for city, state, then get GPS coordinates from that
@@ -351,7 +372,9 @@ lat = 30.25
 lng = -97.76
 daysback = 10
 distKM = 25
+budgetKM = planner.getBudgetForMinutes(180)  #how far we're willing to drive to visit the places
 showprivateplaces = False
+timebudget = None  #set to the number of seconds we're willing to wait for eBird, or None to wait for everything
 findType = askUserForListType()
 
 todomsg = getToDoMsg(findType, state, lat, lng, daysback, distKM)
@@ -372,7 +395,15 @@ if len(needs) == 0:
     sys.exit(0)
 
 #get all the places where the birds we need have been seen. 
-placesdict = getPlacesDict(needs, lat, lng, daysback, distKM)
+if timebudget == None:
+    placesdict = getPlacesDict(needs, lat, lng, daysback, distKM)
+    unresolved = []
+    failed = []
+else:
+    placesdict, unresolved, failed = anytime.getPlacesDictByDeadline(needs, regiondata, state, lat, lng, daysback, distKM, timebudget)
+
+#pick the places worth driving to, and the order to drive them in
+itinerary = planner.planItinerary(placesdict, regiondata, state, lat, lng, budgetKM, showprivate = showprivateplaces)
 
 #generate the files with the results in them
-printResults(todomsg, placesdict, showprivateplaces, regiondata, state)
+printResults(todomsg, placesdict, itinerary, showprivateplaces, regiondata, state, unresolved, failed)
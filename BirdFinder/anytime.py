@@ -0,0 +1,133 @@
+# Set of helper functions for getting the best answer we can in a fixed amount of time
+#
+# Looking up where each bird was seen is one call to eBird per bird, and a slow response holds up
+# everything after it. Instead, we ask for the most valuable birds first, several at a time, and when
+# time runs out we go with whatever has come back.
+import init
+import data
+import ebird
+
+import logging
+import time
+import queue
+import threading
+
+# turn on logging
+log = init.get_module_logger(__name__)
+
+#how many requests to eBird we have going at once
+maxrequests = 4
+
+#Sort the birds we need so the most valuable ones come first. Birds of the same value keep
+#the order eBird reported them in.
+def orderNeedsByValue(needs: list, regiondata: dict, state: str) -> list:
+    return sorted(needs, key=lambda b: data.getSpeciesValue(regiondata, state, b["comName"]), reverse=True)
+
+#Add the places a bird was seen to the places dict, which is of the form
+#    { "locName" : { "lat", "lng", "private", "seen" : (birds) } }
+def addLocationsForBird(placesdict: dict, bird: str, locationlist: list):
+    for p in locationlist:
+        if p["locName"] in placesdict:
+            log.debug("Adding {} to public place {}".format(bird, p["locName"]))
+            placesdict[p["locName"]]["seen"].add(bird)
+        else:
+            log.debug("Adding a new place {} for bird {}".format(p["locName"], bird))
+            placesdict[p["locName"]] = {"lat" : p["lat"], "lng" : p["lng"], "private" : p["locationPrivate"], "seen" : {bird} }
+
+#Same as getPlacesDict, but gives up after timebudget seconds. The lookups are started in order of
+#value, so if we run out of time it's the least interesting birds that are missing.
+#
+#fetch is the function that looks up the places for a bird, it's only there so something other than
+#eBird can be plugged in (e.g. simulateDeadline).
+#
+#Returns a tuple of:
+#  places dict
+#  list of birds from needs that we ran out of time for
+#  list of birds from needs where the lookup failed (e.g. eBird returned an error)
+#Both lists are in order of value.
+def getPlacesDictByDeadline(needs: list, regiondata: dict, state: str, lat: float, lng: float, daysback: int, distKM: int,
+                            timebudget: float, fetch = ebird.getLocationsForBird) -> tuple:
+    log.info("Get places for {} birds in {} seconds".format(len(needs), timebudget))
+
+    deadline = time.monotonic() + timebudget
+    ordered = orderNeedsByValue(needs, regiondata, state)
+
+    #the workers take birds off the front of the todo queue and put (bird, locations, error) on the done
+    #queue. They're daemon threads so a request that never comes back can't stop the program from exiting.
+    todo = queue.Queue()
+    for b in ordered:
+        todo.put(b)
+    done = queue.Queue()
+    stop = threading.Event()
+
+    def worker():
+        while not(stop.is_set()):
+            try:
+                b = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                done.put((b, fetch(lat, lng, daysback, distKM, b["speciesCode"]), None))
+            except Exception as e:
+                done.put((b, [], e))
+
+    for i in range(min(maxrequests, len(ordered))):
+        threading.Thread(target = worker, daemon = True).start()
+
+    placesdict = {}
+    resolved = set()
+    failed = set()
+    answered = 0
+    while answered < len(ordered):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        try:
+            b, locationlist, error = done.get(timeout = remaining)
+        except queue.Empty:
+            break
+
+        answered += 1
+        if error != None:
+            log.critical("Failed to get locations for {}: {}".format(b["comName"], error))
+            failed.add(b["speciesCode"])
+            continue
+
+        resolved.add(b["speciesCode"])
+        if len(locationlist) > 0:
+            addLocationsForBird(placesdict, b["comName"], locationlist)
+        else:
+            log.critical("Ebird says you need {} but then failed to return any locations".format(b["comName"]))
+
+    #out of time, or everything is back. Either way don't start any more requests.
+    stop.set()
+
+    #report the birds we missed in the order of how much we wanted them
+    unresolved = [b for b in ordered if b["speciesCode"] not in resolved and b["speciesCode"] not in failed]
+    if len(unresolved) > 0:
+        log.info("Ran out of time with {} birds not checked".format(len(unresolved)))
+
+    return (placesdict, unresolved, [b for b in ordered if b["speciesCode"] in failed])
+
+#Run getPlacesDictByDeadline against a pretend eBird that takes latency(bird code) seconds to answer,
+#so we can see what a slow connection does to the results. Every bird is seen at one place named
+#after it. If latency(bird code) raises, so does the lookup. Returns the same tuple as getPlacesDictByDeadline.
+def simulateDeadline(needs: list, regiondata: dict, state: str, timebudget: float, latency) -> tuple:
+    def fetch(lat: float, lng: float, daysback: int, distKM: int, code: str) -> list:
+        time.sleep(latency(code))
+        return [{"locName" : "Place for {}".format(code), "lat" : lat, "lng" : lng, "locationPrivate" : False}]
+
+    return getPlacesDictByDeadline(needs, regiondata, state, 30.25, -97.76, 10, 25, timebudget, fetch)
+
+
+if __name__ == "__main__":
+    #three rare birds that answer quickly, and a pile of common ones with one that never answers
+    regiondata = {"US-TX" : {"Bird {}".format(i) : [5 if i < 3 else 1, 1] for i in range(20)}}
+    needs = [{"comName" : "Bird {}".format(i), "speciesCode" : "bird{}".format(i)} for i in reversed(range(20))]
+
+    start = time.monotonic()
+    placesdict, unresolved, failed = simulateDeadline(needs, regiondata, "US-TX", 0.5,
+                                              lambda code: 60 if code == "bird10" else 0.1)
+    print("Finished in {:.2f}s with {} places, not checked: {}".format(time.monotonic() - start, len(placesdict),
+                                                                          [b["comName"] for b in unresolved]))
@@ -15,14 +15,22 @@ def getFullPathToFile(filename:str) -> str:
     abs_file_path = os.path.join(script_dir, filename)
     return abs_file_path
 
-def getRegionFileName(region: str) -> str:
-    assert len(region) == 5, "Region should be 5 characters long" 
-    filename = "data\\ebird_{}__2000_2020_1_12_barchart.txt".format(region)
+#Regions are either a state (US-TX) or a county (US-TX-453). The years default to the range set in init.
+def getRegionFileName(region: str, startyear: int = init.regionstartyear, endyear: int = init.regionendyear) -> str:
+    assert len(region) >= 5, "Region should be at least 5 characters long" 
+    filename = "data\\ebird_{}__{}_{}_1_12_barchart.txt".format(region, startyear, endyear)
     return getFullPathToFile(filename)
 
+#The summarized region data is saved separately for each range of years, so switching ranges doesn't
+#pick up a summary of the wrong years. The original 2000-2020 range keeps its original name.
+def getRegionDataFileName(startyear: int = init.regionstartyear, endyear: int = init.regionendyear) -> str:
+    if startyear == 2000 and endyear == 2020:
+        return "regiondata.json"
+    return "regiondata_{}_{}.json".format(startyear, endyear)
+
 #Check if our datafile exists, and if so, is it newer than all the source data files.
 #Return True if it exists and is newer than all source data, else False
-def checkRegionDataFileValid(filename: str) -> bool:
+def checkRegionDataFileValid(filename: str, startyear: int = init.regionstartyear, endyear: int = init.regionendyear) -> bool:
     result = True
 
     try:
@@ -39,7 +47,7 @@ def checkRegionDataFileValid(filename: str) -> bool:
     
     else:
         for r in init.regions:
-            sourcelastmodified = os.path.getmtime(getRegionFileName(r))
+            sourcelastmodified = os.path.getmtime(getRegionFileName(r, startyear, endyear))
             if datalastmodified <= sourcelastmodified:
                 log.info("Source data is newer than data file")
                 result = False
@@ -81,9 +89,9 @@ def checkRegionDataFileContents(regiondata: dict, ebirdtaxonomy : dict) -> bool:
 
 
 #returns a dict of the form { "bird" : [List of 48 week datas as float] } for a single state
-def loadRegion(r : str, ebirdtaxononmy : dict) -> dict:
+def loadRegion(r : str, ebirdtaxononmy : dict, startyear : int = init.regionstartyear, endyear : int = init.regionendyear) -> dict:
     regiondata = {}
-    with open(getRegionFileName(r), encoding='utf8') as tabfile:
+    with open(getRegionFileName(r, startyear, endyear), encoding='utf8') as tabfile:
         i = 0
         for row in csv.reader(tabfile, delimiter="\t"):
             #skip first 16 lines of the file to get to the first bird
@@ -155,17 +163,17 @@ def compareRegions(data : dict):
 
 #open region file and parse it. 
 #return a dictionary of dictionaries, where the key 
-def loadAllRegionData(ebirdtaxonomy : dict) -> dict:
+def loadAllRegionData(ebirdtaxonomy : dict, startyear : int = init.regionstartyear, endyear : int = init.regionendyear) -> dict:
     
     data = {}
-    datafile = "regiondata.json"
+    datafile = getRegionDataFileName(startyear, endyear)
 
     #TODO 21 may: why does it keep creating the data file? 
 
     #Verify that we have saved region data, and it's newer than all the data file.
     try:
         log.info("Attempting to open old data file")
-        if checkRegionDataFileValid(datafile):
+        if checkRegionDataFileValid(datafile, startyear, endyear):
             with open(datafile, 'r') as openfile: 
                 data = json.load(openfile)
                 if not(checkRegionDataFileContents(data, ebirdtaxonomy)):
@@ -178,7 +186,7 @@ def loadAllRegionData(ebirdtaxonomy : dict) -> dict:
         #If the data file didn't exist, or was older than the source data, or couldn't be
         #opened for whatever reason, then we ignore it and create it from scratch.
         for r in init.regions:
-            regiondata = loadRegion(r, ebirdtaxonomy)
+            regiondata = loadRegion(r, ebirdtaxonomy, startyear, endyear)
             data[r] = summarizeRegion(regiondata)
 
         #TODO figure out how to do the "regionally common" calculation, i.e. a bird that is
@@ -195,4 +203,17 @@ def loadAllRegionData(ebirdtaxonomy : dict) -> dict:
             #if it can't be saved, no problem, we'll recreate it next time
             log.info("Failed to write region datafile")
 
-    return data
\ No newline at end of file
+    return data
+
+#Score how much we want to see a bird in a given state, using the summarized region data. Rarer
+#status counts for more, and so does being found in fewer of the other regions. Birds that aren't
+#in the region data at all are treated like vagrants, since eBird barely knows about them there.
+def getSpeciesValue(regiondata : dict, state : str, bird : str) -> int:
+    vagrant = len(init.birdstatus) - 1
+    status, statecount = regiondata.get(state, {}).get(bird, [vagrant, -1])
+
+    #a count of -1 means the bird wasn't better than vagrant anywhere, so nowhere else helps
+    if statecount < 1:
+        statecount = 0
+
+    return status + len(init.regions) - statecount
@@ -0,0 +1,424 @@
+# Set of helper functions for building our own barchart files from the eBird Basic Dataset (EBD)
+#
+# The EBD and its sampling event file are huge tab separated files (many GB), so we never load them.
+# Instead the file is cut into chunks of bytes, and each chunk is read one line at a time, possibly in
+# another process. Each chunk only returns counts, so memory stays about the same no matter how big
+# the file is. Each process gets one contiguous run of chunks and counts all of them into the same
+# totals, so the counts only have to be sent back and merged once per process.
+#
+# The EBD file has to have all the rows of a checklist next to each other (sorted or grouped by
+# SAMPLING EVENT IDENTIFIER), which is how we count each checklist once without remembering every
+# checklist in the file. That is only checked within a chunk: a file that isn't grouped will almost
+# always repeat a checklist within a chunk and stop with an error, but a checklist whose rows are split
+# between two different chunks is counted twice without any error.
+#
+# Counts are kept per region as:
+#   (samples, birdrows, table)
+#   samples:  array of 48 weekly counts of checklists
+#   birdrows: { bird : row number in table }
+#   table:    array of 48 weekly counts of checklists with the bird on it, for each row
+import init
+import data
+
+import logging
+import os
+import operator
+from array import array
+from multiprocessing import Pool
+
+# turn on logging
+log = init.get_module_logger(__name__)
+
+#how many bytes of the file are read as one chunk. When there's more than one process, chunks are
+#made smaller so every process gets at least one, but never smaller than minchunkbytes.
+chunkbytes = 64 * 1024 * 1024
+minchunkbytes = 1024 * 1024
+
+#how far back from the start of a chunk to look for the row before it. Rows are far shorter than this.
+lookbackbytes = 64 * 1024
+
+#categories where the COMMON NAME column is a species we can count
+countedcategories = (init.Category.SPECIES.value, init.Category.ISSF.value)
+
+monthnames = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+#eBird splits each month into 4 "weeks": 1-7, 8-14, 15-21 and 22 to the end of the month.
+#date is in the form YYYY-MM-DD. Returns a number from 0 to 47.
+def getWeekIndex(date: str) -> int:
+    month = int(date[5:7])
+    day = int(date[8:10])
+    return (month - 1) * 4 + min((day - 1) // 7, 3)
+
+#Read the header row of a file and return a dict of { column name : column number }
+def getColumns(filename: str) -> dict:
+    with open(filename, encoding='utf8') as tabfile:
+        header = tabfile.readline().rstrip("\r\n").split("\t")
+    return {name : i for i, name in enumerate(header)}
+
+#Split the file into a list of (start, end) byte offsets of about chunkbytes each. The first chunk
+#starts after the header row. Chunks don't line up with rows, that gets fixed up when they are read.
+def getFileChunks(filename: str, size: int = None) -> list:
+    if size == None:
+        size = chunkbytes
+
+    with open(filename, 'rb') as tabfile:
+        tabfile.readline()
+        start = tabfile.tell()
+
+    end = os.path.getsize(filename)
+    return [(s, min(s + size, end)) for s in range(start, end, size)]
+
+#Go through every row of one chunk of the file. A row belongs to the chunk it starts in, so we skip
+#the partial row at the start (the previous chunk reads it) and finish the row that crosses the end.
+#
+#If keycolumn is given, rows with the same value in that column (i.e. the rows of one checklist) are
+#kept together: they all belong to the chunk the first of them starts in. Those rows have to be next
+#to each other in the file, so if a value turns up again after a different one in the same chunk, we
+#raise ValueError. Values repeated in a different chunk can't be caught here.
+def getChunkRows(filename: str, start: int, end: int, keycolumn: int = None):
+    with open(filename, 'rb') as tabfile:
+        #read the row just before the chunk so we know which checklist the previous chunk finishes
+        seekto = max(0, start - lookbackbytes)
+        tabfile.seek(seekto)
+        if seekto > 0:
+            tabfile.readline()
+
+        previous = None
+        while tabfile.tell() < start:
+            previous = tabfile.readline().decode('utf8').rstrip("\r\n").split("\t")
+
+        skipping = keycolumn != None and previous != None and len(previous) > keycolumn
+        current = None
+        finished = set()
+        while True:
+            position = tabfile.tell()
+            line = tabfile.readline()
+            if len(line) == 0:
+                break
+
+            row = line.decode('utf8').rstrip("\r\n").split("\t")
+            if keycolumn == None or len(row) <= keycolumn:
+                if position >= end:
+                    break
+                yield row
+                continue
+
+            if skipping:
+                if row[keycolumn] == previous[keycolumn]:
+                    continue
+                skipping = False
+
+            if row[keycolumn] != current:
+                if position >= end:
+                    break
+                if row[keycolumn] in finished:
+                    raise ValueError("{} has rows for {} that aren't next to each other, it needs to be sorted by that column".format(
+                                     filename, row[keycolumn]))
+                if current != None:
+                    finished.add(current)
+
+            current = row[keycolumn]
+            yield row
+
+#Work out which region a row belongs to. County codes look like US-TX-453.
+def getRegionForRow(row: list, columns: dict, county: bool) -> str:
+    if county:
+        return row[columns["COUNTY CODE"]]
+    return row[columns["STATE CODE"]]
+
+#Check the things every row has to have for us to count it: a complete checklist, in one of the
+#years we want, and (if we were given any) in one of the regions we want.
+def isRowWanted(row: list, columns: dict, county: bool, startyear: int, endyear: int, regions: tuple) -> bool:
+    if row[columns["ALL SPECIES REPORTED"]] != "1":
+        return False
+
+    year = int(row[columns["OBSERVATION DATE"]][0:4])
+    if year < startyear or year > endyear:
+        return False
+
+    if len(regions) > 0 and getRegionForRow(row, columns, county) not in regions:
+        return False
+
+    return True
+
+#Get the counts for a region, adding an empty one if it's not there yet
+def getRegionCounts(counts: dict, region: str) -> tuple:
+    if region not in counts:
+        counts[region] = (array('I', [0]) * 48, {}, array('I'))
+    return counts[region]
+
+#Get where a bird's weekly counts start in a region's table, adding a row for it if it's not there yet
+def getBirdOffset(regioncounts: tuple, bird: str) -> int:
+    _, birdrows, table = regioncounts
+    if bird not in birdrows:
+        birdrows[bird] = len(birdrows)
+        table.extend(array('I', [0]) * 48)
+    return birdrows[bird] * 48
+
+#Count one chunk of an EBD file, adding to counts if it's given. Returns a tuple of
+#({ region : counts }, number of rows read)
+#
+#All the rows of a checklist are next to each other, so we only need to remember the checklist we're
+#on to count each checklist and bird once. Chunks never split a checklist, see getChunkRows.
+def countEBDChunk(job: tuple, counts: dict = None) -> tuple:
+    filename, start, end, columns, county, startyear, endyear, regions = job
+
+    if counts == None:
+        counts = {}
+    rows = 0
+    checklist = None
+    wanted = False
+
+    for row in getChunkRows(filename, start, end, columns["SAMPLING EVENT IDENTIFIER"]):
+        rows += 1
+        if len(row) < len(columns):
+            continue
+
+        #everything but the bird is the same for every row of a checklist, so only check it once
+        if row[columns["SAMPLING EVENT IDENTIFIER"]] != checklist:
+            checklist = row[columns["SAMPLING EVENT IDENTIFIER"]]
+            wanted = isRowWanted(row, columns, county, startyear, endyear, regions)
+            if wanted:
+                regioncounts = getRegionCounts(counts, getRegionForRow(row, columns, county))
+                week = getWeekIndex(row[columns["OBSERVATION DATE"]])
+                birds = set()
+                regioncounts[0][week] += 1
+
+        if not(wanted):
+            continue
+
+        bird = row[columns["COMMON NAME"]]
+        if row[columns["CATEGORY"]] in countedcategories and bird not in birds:
+            birds.add(bird)
+            regioncounts[2][getBirdOffset(regioncounts, bird) + week] += 1
+
+    return (counts, rows)
+
+#Count one chunk of a sampling event file, which has one row per checklist. Returns the same tuple
+#as countEBDChunk, with no birds.
+def countSamplingChunk(job: tuple, counts: dict = None) -> tuple:
+    filename, start, end, columns, county, startyear, endyear, regions = job
+
+    if counts == None:
+        counts = {}
+    rows = 0
+
+    for row in getChunkRows(filename, start, end):
+        rows += 1
+        if len(row) < len(columns) or not(isRowWanted(row, columns, county, startyear, endyear, regions)):
+            continue
+
+        regioncounts = getRegionCounts(counts, getRegionForRow(row, columns, county))
+        regioncounts[0][getWeekIndex(row[columns["OBSERVATION DATE"]])] += 1
+
+    return (counts, rows)
+
+#Add the counts from one process into the running totals, in place
+def addRegionCounts(totals: dict, counts: dict):
+    for region in counts:
+        samples, birdrows, table = counts[region]
+        totalcounts = getRegionCounts(totals, region)
+        totalsamples, _, totaltable = totalcounts
+
+        totalsamples[0 : 48] = array('I', map(operator.add, totalsamples, samples))
+
+        for bird, row in birdrows.items():
+            offset = getBirdOffset(totalcounts, bird)
+            totaltable[offset : offset + 48] = array('I', map(operator.add, totaltable[offset : offset + 48], table[row * 48 : row * 48 + 48]))
+
+#Count a contiguous run of chunks into one set of counts. This is what each process in the pool runs.
+#Returns a tuple of ({ region : counts }, number of rows read)
+def countChunkRun(run: tuple) -> tuple:
+    counter, jobs = run
+
+    counts = {}
+    rows = 0
+    for job in jobs:
+        rows += counter(job, counts)[1]
+
+    return (counts, rows)
+
+#Run the counting function over every chunk of the file and add up the results. With more than one
+#process the chunks are split into one contiguous run per process, and each process sends back its
+#counts once when it's done. Returns a tuple of ({ region : counts }, number of rows read)
+def countFile(counter, filename: str, county: bool, startyear: int, endyear: int, regions: tuple, processes: int) -> tuple:
+    log.info("Counting {}".format(filename))
+
+    size = chunkbytes
+    if processes > 1:
+        size = min(chunkbytes, max(minchunkbytes, os.path.getsize(filename) // processes + 1))
+
+    columns = getColumns(filename)
+    jobs = [(filename, s, e, columns, county, startyear, endyear, regions) for (s, e) in getFileChunks(filename, size)]
+
+    if processes > 1 and len(jobs) > 1:
+        processes = min(processes, len(jobs))
+        runs = [(counter, jobs[len(jobs) * p // processes : len(jobs) * (p + 1) // processes]) for p in range(processes)]
+
+        counts = {}
+        rows = 0
+        with Pool(processes) as pool:
+            for result in pool.imap_unordered(countChunkRun, runs):
+                #the first process back becomes the totals, so there's one less merge
+                if len(counts) == 0:
+                    counts = result[0]
+                else:
+                    addRegionCounts(counts, result[0])
+                rows += result[1]
+    else:
+        counts, rows = countChunkRun((counter, jobs))
+
+    log.info("Read {} rows from {} in {} chunks".format(rows, filename, len(jobs)))
+    return (counts, rows)
+
+#Count every region found in an EBD file. If a sampling event file is given, the sample sizes come
+#from it, so checklists where nothing was reported still count. Returns { region : counts }
+def countRegions(ebdfilename: str, samplingfilename: str = None, county: bool = False, startyear: int = init.regionstartyear,
+                 endyear: int = init.regionendyear, regions: tuple = (), processes: int = 1) -> dict:
+    counts, _ = countFile(countEBDChunk, ebdfilename, county, startyear, endyear, regions, processes)
+
+    if samplingfilename != None:
+        samplingcounts, _ = countFile(countSamplingChunk, samplingfilename, county, startyear, endyear, regions, processes)
+        for region in counts:
+            samples = counts[region][0]
+            for week in range(48):
+                samples[week] = samplingcounts[region][0][week] if region in samplingcounts else 0
+
+    return counts
+
+#Turn the counts for one region into a tuple of
+#  { bird : [48 weekly frequencies] }, the same form loadRegion returns
+#  [48 weekly sample sizes]
+def getRegionFrequencies(regioncounts: tuple) -> tuple:
+    samples, birdrows, table = regioncounts
+
+    frequencies = {}
+    for bird, row in birdrows.items():
+        frequencies[bird] = [table[row * 48 + w] / samples[w] if samples[w] > 0 else 0.0 for w in range(48)]
+
+    return (frequencies, list(samples))
+
+#Build barchart data for every region found in an EBD file. Returns a tuple of:
+#  { region : { bird : [48 weekly frequencies] } }
+#  { region : [48 weekly sample sizes] }
+def buildRegionData(ebdfilename: str, samplingfilename: str = None, county: bool = False, startyear: int = init.regionstartyear,
+                    endyear: int = init.regionendyear, regions: tuple = (), processes: int = 1) -> tuple:
+    counts = countRegions(ebdfilename, samplingfilename, county, startyear, endyear, regions, processes)
+
+    regiondata = {}
+    samplesizes = {}
+    for region in counts:
+        regiondata[region], samplesizes[region] = getRegionFrequencies(counts[region])
+
+    return (regiondata, samplesizes)
+
+#Save one region in the same layout as the barchart files downloaded from eBird, so loadRegion can
+#read it: 16 header lines, then one row per bird with 48 frequencies and a trailing tab.
+def writeRegionFile(region: str, regiondata: dict, samplesizes: list, startyear: int = init.regionstartyear,
+                    endyear: int = init.regionendyear, filename: str = None):
+    if filename == None:
+        filename = data.getRegionFileName(region, startyear, endyear)
+
+    log.info("Writing barchart file {}".format(filename))
+    with open(filename, 'w', encoding='utf8') as tabfile:
+        tabfile.write("\n" * 10)
+        tabfile.write("Frequency of observations in the selected location(s).:\n")
+        tabfile.write("Number of taxa: \t{}\n".format(len(regiondata)))
+        tabfile.write("\n")
+        tabfile.write("\t" + "".join("{}\t\t\t\t".format(m) for m in monthnames) + "\n")
+        tabfile.write("Sample Size:\t" + "".join("{}\t".format(float(s)) for s in samplesizes) + "\n")
+        tabfile.write("\n")
+        for bird in regiondata:
+            tabfile.write(bird + "\t" + "".join("{:.7g}\t".format(f) for f in regiondata[bird]) + "\n")
+
+#Build and save barchart files for every region in an EBD file. Each region is turned into
+#frequencies and written on its own, so only one region's worth is ever held as Python floats.
+#To use the files, set init.regionstartyear and init.regionendyear to the same years.
+def ingest(ebdfilename: str, samplingfilename: str = None, county: bool = False, startyear: int = init.regionstartyear,
+           endyear: int = init.regionendyear, regions: tuple = (), processes: int = 1) -> list:
+    counts = countRegions(ebdfilename, samplingfilename, county, startyear, endyear, regions, processes)
+
+    for r in counts:
+        frequencies, samplesizes = getRegionFrequencies(counts[r])
+        writeRegionFile(r, frequencies, samplesizes, startyear, endyear)
+
+    return list(counts)
+
+#Make a fake EBD file with the columns we use, so ingest can be timed without downloading anything
+def makeSyntheticEBDFile(filename: str, checklists: int, birdsperchecklist: int = 15, species: int = 400) -> int:
+    import random
+
+    random.seed(1)
+    header = ["GLOBAL UNIQUE IDENTIFIER", "CATEGORY", "COMMON NAME", "SCIENTIFIC NAME", "OBSERVATION COUNT",
+              "STATE CODE", "COUNTY CODE", "OBSERVATION DATE", "SAMPLING EVENT IDENTIFIER", "ALL SPECIES REPORTED"]
+    birds = ["Bird {}".format(b) for b in range(species)]
+    counties = ["US-TX-{:03}".format(c) for c in range(1, 255, 2)] + ["US-LA-{:03}".format(c) for c in range(1, 128, 2)]
+
+    rows = 0
+    with open(filename, 'w', encoding='utf8') as tabfile:
+        tabfile.write("\t".join(header) + "\n")
+        for c in range(checklists):
+            county = random.choice(counties)
+            date = "{}-{:02}-{:02}".format(random.randint(2000, 2020), random.randint(1, 12), random.randint(1, 28))
+            complete = "1" if random.random() < 0.8 else "0"
+            for b in random.sample(birds, birdsperchecklist):
+                tabfile.write("URN:CornellLabOfOrnithology:EBIRD:OBS{}\tspecies\t{}\tAvis sp.\t1\t{}\t{}\t{}\tS{}\t{}\n".format(
+                              rows, b, county[0:5], county, date, c, complete))
+                rows += 1
+
+    return rows
+
+#Count a file with the given number of processes and put how fast it went and the peak memory of
+#this process and its workers on the results queue. benchmarkIngest starts a fresh process to run this
+#for each setting, since peak memory only ever goes up.
+def benchmarkWorker(filename: str, processes: int, results):
+    import time
+
+    start = time.perf_counter()
+    counts, rows = countFile(countEBDChunk, filename, True, init.regionstartyear, init.regionendyear, (), processes)
+    elapsed = time.perf_counter() - start
+
+    results.put((rows / elapsed, len(counts)) + getPeakMemory())
+
+#Time ingest on a synthetic file, reporting rows per second and peak memory for each number of processes
+def benchmarkIngest(checklists: int = 200000, processes: tuple = (1, 2, 4)) -> list:
+    import tempfile
+    import multiprocessing
+
+    #each setting runs in a new process that starts empty rather than as a copy of this one
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "ebd_synthetic.txt")
+        rows = makeSyntheticEBDFile(filename, checklists)
+        print("Synthetic EBD file: {} rows, {:.0f}MB".format(rows, os.path.getsize(filename) / 1024 / 1024))
+
+        for p in processes:
+            queue = context.Queue()
+            process = context.Process(target=benchmarkWorker, args=(filename, p, queue))
+            process.start()
+            rate, regioncount, main, workers = queue.get()
+            process.join()
+
+            print("{} processes: {:.0f} rows/s, {} regions, peak RSS {:.0f}MB (workers {:.0f}MB)".format(p, rate, regioncount, main, workers))
+            results.append((p, rate, main, workers))
+
+    return results
+
+#Peak resident memory of this process and of the largest worker it has started, in MB. The resource
+#module only exists on Unix, so on Windows we can't say and return zeros.
+def getPeakMemory() -> tuple:
+    try:
+        import resource
+    except ImportError:
+        return (0.0, 0.0)
+
+    #ru_maxrss is in KB on Linux
+    main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return (main, workers)
+
+
+if __name__ == "__main__":
+    benchmarkIngest()
@@ -15,6 +15,7 @@ def get_module_logger(mod_name):
 #Basic data
 lifelistfilename = "MyEBirdData.csv"
 ebirdtaxonomyfilename = "ebird taxonomy.csv"
+snapshotfilename = "warmstate.snapshot"
 
 from enum import Enum
 class Category(Enum):
@@ -45,4 +46,8 @@ class EBirdDictColumns(Enum):
 
 regions = ["US-LA", "US-TX", "US-CA"]
 
+#years the barchart files cover. The hand-downloaded files are 2000-2020, files made by ingest can be any range
+regionstartyear = 2000
+regionendyear = 2020
+
 birdstatus = ("None", "Common", "Unusual", "Seasonal", "Local", "Rare", "Vagrant")
@@ -0,0 +1,246 @@
+# Set of helper functions for turning the places dictionary into a trip you can actually drive
+import init
+import data
+
+import logging
+import math
+
+# turn on logging
+log = init.get_module_logger(__name__)
+
+#average speed used to turn a time budget into a distance budget, including some time to park
+averagespeedKPH = 50
+
+#Distance in km between two GPS coordinates, using the haversine formula
+def getDistanceKM(lat1:float, lng1:float, lat2:float, lng2:float) -> float:
+    earthradiusKM = 6371.0
+
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+
+    return 2 * earthradiusKM * math.asin(math.sqrt(a))
+
+#Convert a time budget in minutes into the distance we could cover in that time
+def getBudgetForMinutes(minutes:int) -> float:
+    return averagespeedKPH * minutes / 60
+
+#Total length of a route. Points is a list of (lat, lng), the first point is always where we start,
+#and order is a list of indexes into points that doesn't include the start.
+def getRouteLength(points:list, order:list, returnhome:bool) -> float:
+    total = 0.0
+    previous = 0
+    for i in order:
+        total += getDistanceKM(*points[previous], *points[i])
+        previous = i
+
+    if returnhome:
+        total += getDistanceKM(*points[previous], *points[0])
+
+    return total
+
+#Order the stops by always driving to the closest one we haven't been to yet
+def getNearestNeighbourOrder(points:list, stops:list) -> list:
+    order = []
+    remaining = set(stops)
+    current = 0
+
+    while len(remaining) > 0:
+        nearest = min(remaining, key=lambda i: (getDistanceKM(*points[current], *points[i]), i))
+        order.append(nearest)
+        remaining.remove(nearest)
+        current = nearest
+
+    return order
+
+#Improve a route by reversing any section of it that makes the route shorter, until
+#nothing else helps. The start point never moves.
+def improveRouteTwoOpt(points:list, order:list, returnhome:bool) -> list:
+    route = [0] + order
+    if returnhome:
+        route.append(0)
+
+    #on a round trip the last point is the trip home, and it has to stay where it is
+    last = len(route) - 1 if returnhome else len(route)
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, last - 1):
+            for j in range(i + 1, last):
+                a = points[route[i - 1]]
+                b = points[route[i]]
+                c = points[route[j]]
+                if j + 1 < len(route):
+                    d = points[route[j + 1]]
+                    change = getDistanceKM(*a, *c) + getDistanceKM(*b, *d) - getDistanceKM(*a, *b) - getDistanceKM(*c, *d)
+                else:
+                    #open route, the last section can be flipped without a following leg
+                    change = getDistanceKM(*a, *c) - getDistanceKM(*a, *b)
+
+                if change < -1e-9:
+                    route[i : j + 1] = reversed(route[i : j + 1])
+                    improved = True
+
+    if returnhome:
+        route.pop()
+
+    return route[1:]
+
+#Pick the set of places to visit and the order to visit them in. This is the greedy for budgeted
+#weighted set cover: each step takes the place with the most value per extra km driven, counting only
+#birds we don't already have on the trip, as long as it fits in the budget. The value of each bird
+#comes from the region data, so a single rare bird can outweigh a handful of common ones. Because
+#that greedy can do badly when one great place is far away, we also try just going to the single most
+#valuable place, and keep whichever trip sees more.
+#
+#To keep it fast with thousands of places, nothing is recomputed from scratch at each step:
+#  - a place's value only changes for the birds the new stop covered, so we look those up by bird
+#  - the cheapest way to fit a place into the route only changes around the new stop, so each place
+#    remembers its distance to every stop and which leg of the route it fits into best
+#
+#Returns a list of place names in the order to visit them.
+def planItinerary(placesdict:dict, regiondata:dict, state:str, lat:float, lng:float, budgetKM:float,
+                  maxstops:int = 10, returnhome:bool = True, showprivate:bool = False) -> list:
+    log.info("Planning itinerary across {} places with a budget of {}km".format(len(placesdict), budgetKM))
+
+    names = [None]
+    points = [(lat, lng)]
+    for p in placesdict:
+        if placesdict[p]["private"] == True and showprivate == False:
+            continue
+
+        #anything we can't even get to and back from on our own is not worth considering
+        away = getDistanceKM(lat, lng, float(placesdict[p]["lat"]), float(placesdict[p]["lng"]))
+        if away * (2 if returnhome else 1) <= budgetKM:
+            names.append(p)
+            points.append((float(placesdict[p]["lat"]), float(placesdict[p]["lng"])))
+
+    #each bird's value is only looked up once, and we keep a list of the places each bird was seen at
+    values = {}
+    placesforbird = {}
+    placevalues = [0] * len(names)
+    for i in range(1, len(names)):
+        for b in placesdict[names[i]]["seen"]:
+            if b not in values:
+                values[b] = data.getSpeciesValue(regiondata, state, b)
+                placesforbird[b] = []
+            placesforbird[b].append(i)
+            placevalues[i] += values[b]
+
+    #the route is a list of legs (from, to), where to is None for the open end of a one way trip.
+    #For every place, distances[i] is { stop : km from place i }, and bestleg/bestcost is the leg
+    #it's cheapest to fit the place into and how many km that adds.
+    legs = [(0, 0)] if returnhome else [(0, None)]
+    distances = [{0 : getDistanceKM(lat, lng, *points[i])} for i in range(len(names))]
+    bestleg = [legs[0]] * len(names)
+    bestcost = [d[0] * (2 if returnhome else 1) for d in distances]
+
+    def getLegLength(leg:tuple) -> float:
+        return 0.0 if leg[1] == None else getDistanceKM(*points[leg[0]], *points[leg[1]])
+
+    def getInsertionCost(i:int, leg:tuple, leglength:float) -> float:
+        if leg[1] == None:
+            return distances[i][leg[0]]
+        return distances[i][leg[0]] + distances[i][leg[1]] - leglength
+
+    #a place right next to the route would otherwise be worth infinitely much per km
+    minimumcost = 0.1
+
+    order = []
+    length = 0.0
+    covered = set()
+    while len(order) < maxstops:
+        best = None
+        for i in range(1, len(names)):
+            if placevalues[i] == 0 or length + bestcost[i] > budgetKM:
+                continue
+            #closer places win ties
+            score = (placevalues[i] / max(bestcost[i], minimumcost), -bestcost[i])
+            if best == None or score > bestscore:
+                best = i
+                bestscore = score
+
+        if best == None:
+            break
+
+        log.debug("Adding {} to the itinerary for {} more km".format(names[best], bestcost[best]))
+        split = bestleg[best]
+        newlegs = [(split[0], best), (best, split[1])]
+        legs[legs.index(split) : legs.index(split) + 1] = newlegs
+        order.insert(([0] + order).index(split[0]), best)
+        length += bestcost[best]
+
+        for b in placesdict[names[best]]["seen"]:
+            if b not in covered:
+                covered.add(b)
+                for i in placesforbird[b]:
+                    placevalues[i] -= values[b]
+
+        #only places still worth something need their cost updated
+        leglengths = {leg : getLegLength(leg) for leg in legs}
+        for i in range(1, len(names)):
+            if placevalues[i] == 0:
+                continue
+            distances[i][best] = getDistanceKM(*points[i], *points[best])
+            if bestleg[i] == split:
+                #the leg this place fit best into is gone, so check every leg again
+                bestcost[i] = math.inf
+                candidates = legs
+            else:
+                candidates = newlegs
+            for leg in candidates:
+                cost = getInsertionCost(i, leg, leglengths[leg])
+                if cost < bestcost[i]:
+                    bestleg[i] = leg
+                    bestcost[i] = cost
+
+    #compare with just going to the most valuable place on its own
+    single = max(range(1, len(names)), key=lambda i: sum(values[b] for b in placesdict[names[i]]["seen"]), default=None)
+    if single != None and sum(values[b] for b in placesdict[names[single]]["seen"]) > sum(values[b] for b in covered):
+        log.info("A trip to just {} beats the greedy itinerary".format(names[single]))
+        order = [single]
+        covered = set(placesdict[names[single]]["seen"])
+
+    #the order we picked the stops in is rarely the best order to drive them in
+    improvedorder = improveRouteTwoOpt(points, getNearestNeighbourOrder(points, order), returnhome)
+    if getRouteLength(points, improvedorder, returnhome) < getRouteLength(points, order, returnhome):
+        order = improvedorder
+
+    log.info("Itinerary has {} stops covering {} birds in {:.1f}km".format(len(order), len(covered), getRouteLength(points, order, returnhome)))
+
+    return [names[i] for i in order]
+
+#Time the planner on made-up places to make sure it stays quick as the number of places grows
+def benchmarkPlanner(sizes:tuple = (100, 1000, 5000, 10000), species:int = 300, birdsperplace:int = 25) -> list:
+    import random
+    import time
+
+    random.seed(1)
+    state = "US-TX"
+    lat = 30.25
+    lng = -97.76
+    birds = ["Bird {}".format(b) for b in range(species)]
+    regiondata = {state : {b : [random.randint(1, 6), random.randint(-1, 3)] for b in birds}}
+
+    results = []
+    for size in sizes:
+        placesdict = {}
+        for p in range(size):
+            placesdict["Place {}".format(p)] = {"lat" : lat + random.uniform(-0.5, 0.5),
+                                                "lng" : lng + random.uniform(-0.5, 0.5),
+                                                "private" : False,
+                                                "seen" : set(random.sample(birds, birdsperplace))}
+
+        start = time.perf_counter()
+        itinerary = planItinerary(placesdict, regiondata, state, lat, lng, 150)
+        elapsed = time.perf_counter() - start
+
+        print("{:>6} places: {:>3} stops in {:.3f}s".format(size, len(itinerary), elapsed))
+        results.append((size, elapsed))
+
+    return results
+
+
+if __name__ == "__main__":
+    benchmarkPlanner()
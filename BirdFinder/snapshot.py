@@ -0,0 +1,331 @@
+# Set of helper functions for saving the data we load at startup into one file that any number of
+# processes can share.
+#
+# The taxonomy, life list and region data are all read-only once they're loaded, but every process
+# that builds them gets its own copy. Instead we write them once into a snapshot file, and each process
+# maps that file into memory. The operating system keeps one copy of the file no matter how many
+# processes map it, and nothing is copied out until a bird is actually looked up.
+#
+# Each snapshot gets its own file name, made from the version and the last modified times of the source
+# files. On Windows a file can't be replaced or deleted while another process has it mapped, so instead
+# of overwriting an old snapshot we write a new file next to it, and every process works out which file
+# matches the current sources.
+#
+# The file is laid out as:
+#   magic, then the length of the header
+#   header: JSON with the version, the last modified time of each source file, and where each section is
+#   sections: for each dictionary, a sorted index of fixed size entries followed by the keys and values.
+#             Values are stored as JSON, so sets (e.g. the years in the life list) come back as lists.
+import init
+
+import logging
+import os
+import glob
+import hashlib
+import json
+import mmap
+import struct
+from collections.abc import Mapping
+
+# turn on logging
+log = init.get_module_logger(__name__)
+
+magic = b"BIRDSNAP"
+version = 1
+
+#each index entry is the offset and length of the key, then the offset and length of the value
+indexentry = struct.Struct("<IIII")
+headerlength = struct.Struct("<I")
+
+#A read-only dictionary that looks keys up directly in the snapshot file. Keys are found with a binary
+#search over the sorted index, and values are only decoded when they are asked for.
+class SnapshotDict(Mapping):
+    def __init__(self, buffer, offset: int, count: int):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+
+    def getEntry(self, i: int) -> tuple:
+        return indexentry.unpack_from(self.buffer, self.offset + i * indexentry.size)
+
+    def getKey(self, i: int) -> bytes:
+        keyoffset, keylength, _, _ = self.getEntry(i)
+        return self.buffer[keyoffset : keyoffset + keylength]
+
+    #Returns the index of the key, or -1 if it isn't there
+    def find(self, key: str) -> int:
+        if not(isinstance(key, str)):
+            return -1
+
+        target = key.encode('utf8')
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.getKey(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self.count and self.getKey(low) == target:
+            return low
+        return -1
+
+    def __getitem__(self, key: str):
+        i = self.find(key)
+        if i == -1:
+            raise KeyError(key)
+
+        _, _, valueoffset, valuelength = self.getEntry(i)
+        return json.loads(self.buffer[valueoffset : valueoffset + valuelength].decode('utf8'))
+
+    def __contains__(self, key) -> bool:
+        return self.find(key) != -1
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.getKey(i).decode('utf8')
+
+    def __len__(self) -> int:
+        return self.count
+
+#Turn a dictionary into the bytes of one section, starting at offset in the file.
+#Returns a tuple of (bytes, number of keys)
+def encodeSection(values: dict, offset: int) -> tuple:
+    def convert(value):
+        if isinstance(value, set):
+            return sorted(value)
+        raise TypeError("Can't save {} in a snapshot".format(type(value)))
+
+    keys = sorted(values, key=lambda k: k.encode('utf8'))
+    encodedkeys = [k.encode('utf8') for k in keys]
+    encodedvalues = [json.dumps(values[k], default=convert, ensure_ascii=False).encode('utf8') for k in keys]
+
+    index = bytearray()
+    body = bytearray()
+    bodyoffset = offset + len(keys) * indexentry.size
+    for k, v in zip(encodedkeys, encodedvalues):
+        keyoffset = bodyoffset + len(body)
+        body += k
+        valueoffset = bodyoffset + len(body)
+        body += v
+        index += indexentry.pack(keyoffset, len(k), valueoffset, len(v))
+
+    return (bytes(index + body), len(keys))
+
+#Get the last modified time of each source file, so we can tell if the snapshot is out of date.
+#Files that don't exist are left out.
+def getSourceTimes(sources: list) -> dict:
+    result = {}
+    for s in sources:
+        try:
+            result[s] = os.path.getmtime(s)
+        except OSError:
+            log.info("Source file {} doesn't exist".format(s))
+    return result
+
+#Get the name of the snapshot file for the current version and source files, e.g.
+#warmstate.snapshot.v1.0123456789ab for a filename of warmstate.snapshot
+def getSnapshotFileName(filename: str, sources: list) -> str:
+    sourcetimes = json.dumps(getSourceTimes(sources), sort_keys=True).encode('utf8')
+    return "{}.v{}.{}".format(filename, version, hashlib.sha1(sourcetimes).hexdigest()[0:12])
+
+#Delete every snapshot for filename except the current one. Anything still mapped by another process
+#can't be deleted on Windows, that's fine, it will get cleaned up next time.
+def removeOldSnapshots(filename: str, current: str):
+    for old in glob.glob(glob.escape(filename) + ".v*"):
+        if old == current or old.endswith(".tmp"):
+            continue
+        try:
+            os.remove(old)
+        except OSError:
+            log.info("Couldn't remove old snapshot {}".format(old))
+
+#Save the taxonomy, life list and region data to a snapshot file. Sources is the list of files they
+#were built from. Returns True if the snapshot was saved.
+def writeSnapshot(filename: str, ebirdtaxonomy: dict, lifedict: dict, regiondata: dict, sources: list) -> bool:
+    current = getSnapshotFileName(filename, sources)
+    log.info("Writing snapshot {}".format(current))
+
+    #each region gets its own section, so looking up a state doesn't decode every bird in it
+    sectiondata = {"taxonomy" : ebirdtaxonomy, "lifelist" : lifedict}
+    for r in regiondata:
+        sectiondata["region " + r] = regiondata[r]
+
+    #the header has to say where the sections are, which depends on how long the header is, so keep
+    #laying the sections out again until the header stops changing length
+    header = {"version" : version, "sources" : getSourceTimes(sources), "regions" : list(regiondata), "sections" : {}}
+    while True:
+        start = len(magic) + headerlength.size + len(json.dumps(header).encode('utf8'))
+        sections = []
+        offset = start
+        for name in sectiondata:
+            section, count = encodeSection(sectiondata[name], offset)
+            header["sections"][name] = [offset, count]
+            sections.append(section)
+            offset += len(section)
+
+        encodedheader = json.dumps(header).encode('utf8')
+        if len(magic) + headerlength.size + len(encodedheader) == start:
+            break
+
+    #write to a temporary file and rename it, so a process attaching at the same time never sees half a file
+    temporary = "{}.{}.tmp".format(current, os.getpid())
+    try:
+        with open(temporary, 'wb') as snapshotfile:
+            snapshotfile.write(magic)
+            snapshotfile.write(headerlength.pack(len(encodedheader)))
+            snapshotfile.write(encodedheader)
+            for section in sections:
+                snapshotfile.write(section)
+
+        if os.path.exists(current):
+            #another process already wrote this snapshot, and may have it mapped
+            os.remove(temporary)
+        else:
+            os.replace(temporary, current)
+
+    except OSError as e:
+        log.critical("Failed to write snapshot {}: {}".format(current, e))
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
+
+    removeOldSnapshots(filename, current)
+    return True
+
+#Map the snapshot file for the current sources into memory and check that it's still good: right
+#version, and none of the source files have changed since it was written. Returns a tuple of
+#(taxonomy, life list, region data) where the region data is a dict of { state : SnapshotDict },
+#or None if there's no usable snapshot.
+def attachSnapshot(filename: str, sources: list):
+    filename = getSnapshotFileName(filename, sources)
+    try:
+        with open(filename, 'rb') as snapshotfile:
+            buffer = mmap.mmap(snapshotfile.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        log.info("Snapshot {} doesn't exist or is empty".format(filename))
+        return None
+
+    try:
+        if buffer[0 : len(magic)] != magic:
+            raise ValueError("not a snapshot file")
+
+        length = headerlength.unpack_from(buffer, len(magic))[0]
+        start = len(magic) + headerlength.size
+        header = json.loads(buffer[start : start + length].decode('utf8'))
+
+        if header["version"] != version:
+            raise ValueError("snapshot is version {}, expected {}".format(header["version"], version))
+
+        if header["sources"] != getSourceTimes(sources):
+            raise ValueError("source data has changed")
+
+        sections = {name : SnapshotDict(buffer, offset, count) for name, (offset, count) in header["sections"].items()}
+
+    except (ValueError, KeyError, struct.error) as e:
+        log.info("Snapshot {} can't be used: {}".format(filename, e))
+        buffer.close()
+        return None
+
+    regiondata = {r : sections["region " + r] for r in header["regions"]}
+    return (sections["taxonomy"], sections["lifelist"], regiondata)
+
+#Resident memory of this process in MB, split into what's shared with other processes and what isn't.
+#Only Linux reports this, elsewhere we can't say.
+def getMemoryUsage() -> tuple:
+    try:
+        with open("/proc/self/smaps_rollup") as statusfile:
+            fields = {}
+            for line in statusfile:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    except OSError:
+        return (0.0, 0.0)
+
+    return (fields.get("Rss", 0.0), fields.get("Pss", 0.0))
+
+#Worker for benchmarkSnapshot. Loads the data either from the snapshot or from the source files, looks
+#up a few birds so it's actually used, and reports how long that took. Memory is only measured once
+#every worker has loaded, so shared pages are shared between all of them.
+def benchmarkWorker(filename: str, sources: list, usesnapshot: bool, barrier, results):
+    import time
+    import ebird
+
+    start = time.perf_counter()
+    if usesnapshot:
+        ebirdtaxonomy, lifedict, regiondata = attachSnapshot(filename, sources)
+    else:
+        ebirdtaxonomy = ebird.getEbirdTaxonomyDict(init.ebirdtaxonomyfilename)
+        lifedict = makeBenchmarkLifeDict(ebirdtaxonomy)
+        with open("regiondata.json", 'r') as openfile:
+            regiondata = json.load(openfile)
+
+    for bird in ("Northern Cardinal", "Golden-cheeked Warbler", "Whooping Crane"):
+        ebird.isValid(ebirdtaxonomy[bird])
+        bird in lifedict
+        regiondata["US-TX"].get(bird)
+    elapsed = time.perf_counter() - start
+
+    barrier.wait()
+    results.put((elapsed,) + getMemoryUsage())
+    barrier.wait()
+
+#The real life list isn't checked in, so make one the same shape: every species, seen in a state or two
+def makeBenchmarkLifeDict(ebirdtaxonomy: dict) -> dict:
+    lifedict = {}
+    for i, bird in enumerate(ebirdtaxonomy):
+        lifedict[bird] = {init.regions[i % len(init.regions)] : {"2019", "2020"}}
+    return lifedict
+
+#Time how long each worker takes to get going, and how much memory they use in total, with and without
+#the snapshot. Memory is reported as RSS (which counts shared pages in every process) and PSS (which
+#splits shared pages between the processes sharing them, so it adds up to the real total).
+#
+#The region data is read straight from regiondata.json rather than rebuilt from the barchart files,
+#which is the fastest the main program could ever load it.
+def benchmarkSnapshot(workers: tuple = (1, 8, 32)) -> list:
+    import ebird
+    import tempfile
+    import multiprocessing
+
+    #new processes start empty rather than as a copy of this one, like separate workers would
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        filename = os.path.join(tempdir, "snapshot.bin")
+        sources = [init.ebirdtaxonomyfilename, "regiondata.json"]
+
+        ebirdtaxonomy = ebird.getEbirdTaxonomyDict(init.ebirdtaxonomyfilename)
+        with open("regiondata.json", 'r') as openfile:
+            writeSnapshot(filename, ebirdtaxonomy, makeBenchmarkLifeDict(ebirdtaxonomy), json.load(openfile), sources)
+        del ebirdtaxonomy
+        print("Snapshot is {:.1f}MB".format(os.path.getsize(getSnapshotFileName(filename, sources)) / 1024 / 1024))
+
+        for usesnapshot in (False, True):
+            for n in workers:
+                barrier = context.Barrier(n)
+                queue = context.Queue()
+                processes = [context.Process(target=benchmarkWorker, args=(filename, sources, usesnapshot, barrier, queue)) for i in range(n)]
+                for p in processes:
+                    p.start()
+                stats = [queue.get() for p in processes]
+                for p in processes:
+                    p.join()
+
+                startup = sum(s[0] for s in stats) / n
+                rss = sum(s[1] for s in stats)
+                pss = sum(s[2] for s in stats)
+                print("{:>8} {:>3} workers: {:.3f}s startup each, total RSS {:.0f}MB, PSS {:.0f}MB".format(
+                      "snapshot" if usesnapshot else "rebuild", n, startup, rss, pss))
+                results.append((usesnapshot, n, startup, rss, pss))
+
+    return results
+
+
+if __name__ == "__main__":
+    benchmarkSnapshot()
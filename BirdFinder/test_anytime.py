@@ -0,0 +1,79 @@
+#Tests for the time-budgeted lookups in anytime.py, using a pretend eBird whose response time we control.
+#Run from this folder with: python -m unittest test_anytime
+import unittest
+import time
+
+import anytime
+
+state = "US-TX"
+
+#Birds 0-5 have status 6 down to 1, so bird 0 is the most valuable and bird 5 the least. They're listed
+#in needs least valuable first, the opposite of the order they should be looked up in.
+regiondata = {state : {"Bird {}".format(i) : [6 - i, 1] for i in range(6)}}
+needs = [{"comName" : "Bird {}".format(i), "speciesCode" : "bird{}".format(i)} for i in reversed(range(6))]
+valueorder = ["bird{}".format(i) for i in range(6)]
+
+def getCodes(birds: list) -> list:
+    return [b["speciesCode"] for b in birds]
+
+class TestGetPlacesDictByDeadline(unittest.TestCase):
+    def setUp(self):
+        self.maxrequests = anytime.maxrequests
+        self.started = []
+
+    def tearDown(self):
+        anytime.maxrequests = self.maxrequests
+
+    #Make a latency function that records the order lookups start in
+    def latency(self, seconds: dict, default: float = 0.01):
+        def getLatency(code: str) -> float:
+            self.started.append(code)
+            return seconds.get(code, default)
+        return getLatency
+
+    def test_lookup_that_never_returns_is_cut_off_at_deadline(self):
+        start = time.monotonic()
+        placesdict, unresolved, failed = anytime.simulateDeadline(needs, regiondata, state, 0.5, self.latency({"bird3" : 60}))
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(getCodes(unresolved), ["bird3"])
+        self.assertEqual(failed, [])
+        self.assertEqual(len(placesdict), 5)
+
+    def test_lookups_start_in_value_order(self):
+        #one at a time, with the common birds too slow to make the deadline
+        anytime.maxrequests = 1
+        slow = {"bird3" : 1, "bird4" : 1, "bird5" : 1}
+        placesdict, unresolved, failed = anytime.simulateDeadline(needs, regiondata, state, 0.3, self.latency(slow))
+
+        self.assertEqual(self.started, valueorder[0 : len(self.started)])
+        self.assertEqual(set(placesdict), {"Place for bird0", "Place for bird1", "Place for bird2"})
+        self.assertEqual(getCodes(unresolved), ["bird3", "bird4", "bird5"])
+
+    def test_unresolved_keeps_value_order(self):
+        #with every lookup hanging, nothing comes back and every bird is unresolved
+        placesdict, unresolved, failed = anytime.simulateDeadline(needs, regiondata, state, 0.2, self.latency({}, 60))
+
+        self.assertEqual(placesdict, {})
+        self.assertEqual(getCodes(unresolved), valueorder)
+
+    def test_lookup_that_raises_does_not_stop_the_run(self):
+        def latency(code: str) -> float:
+            if code == "bird2":
+                raise OSError("HTTP 500")
+            return 0.01
+
+        start = time.monotonic()
+        placesdict, unresolved, failed = anytime.simulateDeadline(needs, regiondata, state, 5, latency)
+        elapsed = time.monotonic() - start
+
+        #everything came back, so we shouldn't have waited for the deadline
+        self.assertLess(elapsed, 1)
+        self.assertEqual(getCodes(failed), ["bird2"])
+        self.assertEqual(unresolved, [])
+        self.assertEqual(len(placesdict), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()